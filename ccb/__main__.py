@@ -12,6 +12,17 @@ from ccb.update.manual import manual_update_recipes
 from ccb.update.auto import auto_update_all_recipes
 from ccb.github import set_github_token
 from ccb.issue import update_status_issue
+from ccb.http_session import close_client_session
+
+
+def run(coro):
+    async def run_and_close():
+        try:
+            return await coro
+        finally:
+            await close_client_session()
+
+    return asyncio.run(run_and_close())
 
 
 def bad_command(parser):
@@ -26,7 +37,7 @@ def cmd_status(args):
         # The user specified a list, show it all
         args.all = True
 
-    return asyncio.run(
+    return run(
         print_status_table(
             cci_path=args.cci,
             recipes_names=args.recipe,
@@ -36,7 +47,7 @@ def cmd_status(args):
 
 
 def cmd_update(args):
-    return asyncio.run(
+    return run(
         manual_update_recipes(
             cci_path=args.cci,
             recipes=args.recipe,
@@ -50,7 +61,7 @@ def cmd_update(args):
 
 
 def cmd_update_status_issue(args):
-    return asyncio.run(
+    return run(
         update_status_issue(
             update_status_path=args.update_status,
             issue_url_list=args.issue_url,
@@ -60,7 +71,7 @@ def cmd_update_status_issue(args):
 
 
 def cmd_auto_update_recipes(args):
-    return asyncio.run(
+    return run(
         auto_update_all_recipes(
             cci_path=args.cci,
             push_to=args.push_to,
@@ -0,0 +1,56 @@
+import os
+import json
+import sqlite3
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# Persistent cache shared across runs, set CCB_CACHE_DIR to an empty string to disable
+CACHE_DIR = os.environ.get(
+    "CCB_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "conan-center-bot"),
+)
+
+
+class DiskCache:
+    def __init__(self, name):
+        self.name = name
+        self.__db = None
+
+    def _db(self):
+        if self.__db is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            self.__db = sqlite3.connect(os.path.join(CACHE_DIR, f"{self.name}.sqlite"))
+            self.__db.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT)"
+            )
+        return self.__db
+
+    def get(self, key, default=None):
+        if not CACHE_DIR:
+            return default
+        try:
+            row = (
+                self._db()
+                .execute("SELECT value FROM cache WHERE key = ?", (key,))
+                .fetchone()
+            )
+        except (OSError, sqlite3.Error) as exc:
+            logger.debug("%s cache: cannot read %s: %s", self.name, key, exc)
+            return default
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        if not CACHE_DIR:
+            return
+        try:
+            with self._db() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)",
+                    (key, json.dumps(value)),
+                )
+        except (OSError, sqlite3.Error) as exc:
+            logger.debug("%s cache: cannot write %s: %s", self.name, key, exc)
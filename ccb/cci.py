@@ -1,59 +1,64 @@
 import re
 import logging
-import aiohttp
 
-from .github import get_github_token
+from .github import get_all_pages
 from .subprocess import check_output
 from .utils import LockStorage
 
 logger = logging.getLogger(__name__)
 pr_lock = LockStorage()
 
+RE_WORD = re.compile(r"[\w-]+")
+RE_WORD_BEFORE_SLASH = re.compile(r"([\w-]+)/")
+
 
 class _CciInterface:
     def __init__(self):
         self.owner = "conan-io"
         self.repo = "conan-center-index"
         self.__pull_requests = None
+        self.__pull_requests_index = None
+        self.__owner_and_repo = {}
 
     async def pull_requests(self):
         async with pr_lock.get():
             if self.__pull_requests is None:
-                github_token = get_github_token()
-                headers = {"Accept": "application/vnd.github.v3+json"}
-                if github_token:
-                    headers["Authorization"] = f"token {github_token}"
-                url = f"https://api.github.com/repos/{self.owner}/{self.repo}/pulls"
-
-                prs = list()
-
-                page = 1
-                async with aiohttp.ClientSession(raise_for_status=True) as client:
-                    while True:
-                        logger.debug("getting PR page %s", page)
-                        params = {"page": str(page), "per_page": "100"}
-                        async with client.get(
-                            url, params=params, headers=headers
-                        ) as resp:
-                            results = await resp.json()
-                        prs.extend(results)
-                        page += 1
-
-                        logger.debug("%s results", len(results))
-                        if not results:
-                            break
-                self.__pull_requests = prs
+                self.__pull_requests = await get_all_pages(
+                    f"https://api.github.com/repos/{self.owner}/{self.repo}/pulls"
+                )
 
             return self.__pull_requests
 
-    @staticmethod
-    async def owner_and_repo(cci_path, remote):
-        pattern = re.compile(r"[/:]([^/]+)/([^/]+)\.git")
-        origin = await check_output(
-            ["git", "config", "--get", f"remote.{remote}.url"], cwd=cci_path
-        )
+    async def pull_requests_mentioning(self, name):
+        # PRs that may mention "name/" in their body or "name" in their title,
+        # a superset of what a recipe has to search when its name is a word
+        prs = await self.pull_requests()
+        if self.__pull_requests_index is None:
+            index = {}
+            for pr in prs:
+                words = set()
+                for word in RE_WORD_BEFORE_SLASH.findall(pr.get("body") or ""):
+                    words.update(word[i:] for i in range(len(word)))
+                for word in RE_WORD.findall(pr.get("title") or ""):
+                    words.update(
+                        word[i:j]
+                        for i in range(len(word))
+                        for j in range(i + 1, len(word) + 1)
+                    )
+                for word in words:
+                    index.setdefault(word, []).append(pr)
+            self.__pull_requests_index = index
+        return self.__pull_requests_index.get(name, [])
 
-        return pattern.search(origin).groups()
+    async def owner_and_repo(self, cci_path, remote):
+        key = (cci_path, remote)
+        if key not in self.__owner_and_repo:
+            pattern = re.compile(r"[/:]([^/]+)/([^/]+)\.git")
+            origin = await check_output(
+                ["git", "config", "--get", f"remote.{remote}.url"], cwd=cci_path
+            )
+            self.__owner_and_repo[key] = pattern.search(origin).groups()
+        return self.__owner_and_repo[key]
 
 
 cci_interface = _CciInterface()
@@ -2,9 +2,20 @@ import os
 import tempfile
 import subprocess
 import shutil
+import functools
+
+try:
+    import pygit2
+except ImportError:
+    pygit2 = None
 
 from .recipe import Recipe, VersionedRecipe
-from .subprocess import call, check_call, check_output
+from .subprocess import call, check_call, check_output, check_call_in_thread
+from .utils import LockStorage
+
+
+refs_lock = LockStorage()
+_refs_snapshots = {}
 
 
 class RecipeInWorktree:
@@ -16,17 +27,46 @@ class RecipeInWorktree:
         self.tmpdir = tempfile.mkdtemp(prefix="ccb-")
         try:
             await check_call(
-                ["git", "worktree", "add", "-q", "--checkout", "--detach", self.tmpdir],
+                [
+                    "git",
+                    "worktree",
+                    "add",
+                    "-q",
+                    "--no-checkout",
+                    "--detach",
+                    self.tmpdir,
+                ],
                 cwd=self.recipe.path,
             )
+            await self._write_sparse_checkout()
+            await check_call(
+                ["git", "-c", "core.sparseCheckout=true", "checkout", "-q"],
+                cwd=self.tmpdir,
+            )
             new_recipe = Recipe(self.tmpdir, self.recipe.name)
             if isinstance(self.recipe, VersionedRecipe):
-                new_recipe = new_recipe.for_version(self.recipe.version)
+                # same upstream: reuse its parsed versions and digests
+                new_recipe = new_recipe.for_version(
+                    self.recipe.version, self.recipe.upstream()
+                )
             return new_recipe
         except BaseException:
             await self.cleanup()
             raise
 
+    async def _write_sparse_checkout(self):
+        # only materialize the recipe; the skip-worktree bits set by this
+        # checkout are honored by later commands without any config change,
+        # so the main worktree is never made sparse
+        path = await check_output(
+            ["git", "rev-parse", "--git-path", "info/sparse-checkout"],
+            cwd=self.tmpdir,
+        )
+        path = os.path.join(self.tmpdir, path.strip())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fil:
+            fil.write(f"/recipes/{self.recipe.name}/\n")
+
     async def __aexit__(self, exc_type, exc_value, exc_traceback):
         await self.cleanup()
 
@@ -39,37 +79,66 @@ class RecipeInWorktree:
         )
         if os.path.exists(self.tmpdir):
             shutil.rmtree(self.tmpdir)
+        _refs_snapshots.pop(self.tmpdir, None)
         self.tmpdir = None
 
 
-async def branch_exists(recipe, branch_name):
-    return (
-        await call(
-            ["git", "show-ref", "--verify", "-q", f"refs/heads/{branch_name}"],
-            cwd=recipe.path,
-        )
-        == 0
-    )
+# one entry per checkout, recipes share the repository of their checkout and
+# the worktrees of the running updates come and go
+@functools.lru_cache(maxsize=32)
+def _repository(path):
+    if pygit2 is None:
+        return None
+    repo_path = pygit2.discover_repository(path)
+    if repo_path is None:
+        return None
+    return pygit2.Repository(repo_path)
+
+
+async def _refs_snapshot(recipe):
+    async with refs_lock.get():
+        if recipe.cci_path not in _refs_snapshots:
+            output = await check_output(
+                [
+                    "git",
+                    "for-each-ref",
+                    "--format=%(refname)",
+                    "refs/heads",
+                    "refs/remotes",
+                ],
+                cwd=recipe.cci_path,
+            )
+            _refs_snapshots[recipe.cci_path] = set(output.splitlines())
+        return _refs_snapshots[recipe.cci_path]
 
 
-async def remote_branch_exists(recipe, branch_name, remote):
-    return (
-        await call(
-            [
-                "git",
-                "show-ref",
-                "--verify",
-                "-q",
-                f"refs/remotes/{remote}/{branch_name}",
-            ],
-            cwd=recipe.path,
-        )
-        == 0
-    )
+def _update_refs_snapshots(added=(), removed=()):
+    # all worktrees share the refs of the CCI repository
+    for refs in _refs_snapshots.values():
+        refs.update(added)
+        refs.difference_update(removed)
+
+
+async def refs_present(recipe, refs):
+    repo = _repository(recipe.cci_path)
+    if repo is not None:
+        return {ref for ref in refs if ref in repo.references}
+
+    return set(refs) & await _refs_snapshot(recipe)
+
+
+def branch_ref(branch_name):
+    return f"refs/heads/{branch_name}"
+
+
+def remote_branch_ref(branch_name, remote):
+    return f"refs/remotes/{remote}/{branch_name}"
 
 
 async def create_branch_and_commit(recipe, branch_name, commit_msg):
-    await check_call(["git", "checkout", "-q", "-b", branch_name], cwd=recipe.path)
+    if pygit2 is None:
+        await check_call(["git", "checkout", "-q", "-b", branch_name], cwd=recipe.path)
+
     await check_call(
         [
             "git",
@@ -82,27 +151,44 @@ async def create_branch_and_commit(recipe, branch_name, commit_msg):
         cwd=recipe.path,
     )
 
+    if pygit2 is not None:
+        # point the branch at the new commit without another git process,
+        # the worktree stays detached
+        repo = pygit2.Repository(recipe.path)
+        repo.branches.local.create(branch_name, repo[repo.head.target])
+    _update_refs_snapshots(added=[branch_ref(branch_name)])
+
 
 async def remove_branch(recipe, branch_name):
-    await check_call(["git", "branch", "-q", "-D", branch_name], cwd=recipe.path)
+    await check_call_in_thread(
+        ["git", "branch", "-q", "-D", branch_name], cwd=recipe.path
+    )
+    _update_refs_snapshots(removed=[branch_ref(branch_name)])
 
 
 async def push_branch(recipe, remote, branch_name, force):
-    await check_call(
-        ["git", "push", "-q", "--set-upstream"]
+    await push_branches(recipe, remote, [branch_name], force)
+
+
+async def push_branches(recipe, remote, branch_names, force):
+    # all or nothing: one connection and one pack for every branch
+    await check_call_in_thread(
+        ["git", "push", "-q", "--atomic", "--set-upstream"]
         + (["-f"] if force else [])
-        + [remote, branch_name],
+        + [remote]
+        + list(branch_names),
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL,
         cwd=recipe.path,
     )
+    _update_refs_snapshots(
+        added=[remote_branch_ref(branch_name, remote) for branch_name in branch_names]
+    )
 
 
 async def count_commits_matching(git_path, pattern):
-    lines = (
-        await check_output(
-            ["git", "log", "--oneline", f"--grep={pattern}"],
-            cwd=git_path,
-        )
-    ).splitlines()
-    return len(lines)
+    output = await check_output(
+        ["git", "rev-list", "--count", f"--grep={pattern}", "HEAD"],
+        cwd=git_path,
+    )
+    return int(output)
@@ -1,3 +1,15 @@
+import asyncio
+import logging
+
+from .http_session import client_session
+from .cache import DiskCache
+
+
+logger = logging.getLogger(__name__)
+pages_cache = DiskCache("github_pages")
+PER_PAGE = 100
+
+
 class _GitHubToken:
     value = None
 
@@ -8,3 +20,61 @@ def get_github_token():
 
 def set_github_token(token):
     _GitHubToken.value = token
+
+
+def github_headers():
+    headers = {"Accept": "application/vnd.github.v3+json"}
+    github_token = get_github_token()
+    if github_token:
+        headers["Authorization"] = f"token {github_token}"
+    return headers
+
+
+async def get_all_pages(url, cached=False):
+    # with cached, pages are requested with their last ETag: an unchanged
+    # page is answered with an empty 304 which does not count in the rate limit
+    headers = github_headers()
+
+    async def get_page(page):
+        logger.debug("getting %s page %s", url, page)
+        params = {"page": str(page), "per_page": str(PER_PAGE)}
+        key = f"{url}?page={page}"
+        entry = pages_cache.get(key) if cached else None
+        page_headers = headers
+        if entry is not None:
+            page_headers = {**headers, "If-None-Match": entry["etag"]}
+        async with client_session().get(
+            url, params=params, headers=page_headers
+        ) as resp:
+            last = resp.links.get("last")
+            last_page = int(last["url"].query["page"]) if last is not None else None
+            if resp.status == 304:
+                logger.debug("page not modified")
+                return entry["results"], last_page or entry["last_page"]
+            results = await resp.json()
+            etag = resp.headers.get("ETag")
+        logger.debug("%s results", len(results))
+        if cached and etag:
+            pages_cache.set(
+                key, {"etag": etag, "results": results, "last_page": last_page}
+            )
+        return results, last_page
+
+    # the first page tells how many there are, fetch the
+    # others concurrently instead of one after the other
+    results, last_page = await get_page(1)
+    page_results = results
+    if last_page is not None:
+        pages = await asyncio.gather(
+            *[get_page(page) for page in range(2, last_page + 1)]
+        )
+        for page_results, _ in pages:
+            results.extend(page_results)
+
+    # the number of pages may come from a cached page, check there is no more
+    page = last_page or 1
+    while len(page_results) == PER_PAGE:
+        page += 1
+        page_results, _ = await get_page(page)
+        results.extend(page_results)
+    return results
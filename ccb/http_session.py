@@ -0,0 +1,19 @@
+import asyncio
+import aiohttp
+
+
+_sessions = dict()
+
+
+def client_session():
+    # one session per loop: connections and TLS sessions are reused by all requests
+    loop = asyncio.get_running_loop()
+    if loop not in _sessions:
+        _sessions[loop] = aiohttp.ClientSession(raise_for_status=True)
+    return _sessions[loop]
+
+
+async def close_client_session():
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
@@ -3,9 +3,9 @@ import time
 import json
 import datetime
 import logging
-import aiohttp
 
 from .github import get_github_token
+from .http_session import client_session
 from .utils import format_duration
 
 
@@ -30,13 +30,15 @@ async def _update_issue(issue_url, content):
     data = {"body": content}
 
     for _ in range(NTRY):
-        async with aiohttp.ClientSession() as client:
-            async with client.patch(url, json=data, headers=headers) as resp:
-                if resp.ok:
-                    return True
-
-                logger.error("update failed: %s (%d)", resp.reason, resp.status)
-                time.sleep(TRY_SLEEP)
+        # failures are retried here instead of raised
+        async with client_session().patch(
+            url, json=data, headers=headers, raise_for_status=False
+        ) as resp:
+            if resp.ok:
+                return True
+
+            logger.error("update failed: %s (%d)", resp.reason, resp.status)
+            time.sleep(TRY_SLEEP)
 
     return False
 
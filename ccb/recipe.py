@@ -7,11 +7,11 @@ import importlib.util
 
 from conans import ConanFile
 
-from .version import Version
+from .version import Version, parse_version
 from .upstream_project import get_upstream_project
 from .utils import return_on_exc
-from .cci import cci_interface
-from .yaml import yaml
+from .cci import cci_interface, RE_WORD
+from .yaml import fast_load_file
 
 
 logger = logging.getLogger(__name__)
@@ -34,56 +34,72 @@ class LibPullRequest(typing.NamedTuple):
 
 class Recipe:
     def __init__(self, cci_path, name):
+        self.cci_path = cci_path
         self.name = name
         self.path = os.path.join(cci_path, "recipes", name)
         self.config_path = os.path.join(self.path, "config.yml")
+        self.__config = None
+        self.__versions = None
+        self.__folders = None
 
     @property
     def supported(self):
         return os.path.exists(self.config_path)
 
     def config(self):
-        if not os.path.exists(self.config_path):
-            raise RecipeError("No config.yml file")
+        if self.__config is None:
+            if not os.path.exists(self.config_path):
+                raise RecipeError("No config.yml file")
 
-        with open(self.config_path) as fil:
-            return yaml.load(fil)
+            self.__config = fast_load_file(self.config_path)
+        return self.__config
 
     def versions(self):
-        try:
-            return [Version(v) for v in self.config()["versions"].keys()]
-        except RecipeError as exc:
-            logger.debug("%s: could not find versions: %s", self.name, exc)
-            return []
+        if self.__versions is None:
+            try:
+                self.__versions = [
+                    parse_version(v) for v in self.config()["versions"].keys()
+                ]
+            except RecipeError as exc:
+                logger.debug("%s: could not find versions: %s", self.name, exc)
+                self.__versions = []
+        return self.__versions
 
     def most_recent_version(self):
         versions = self.versions()
         if not versions:
             return Version()
-        return sorted(versions)[-1]
+        # the last of equal versions, as sorting would
+        return max(reversed(versions))
 
     def folder(self, version):
         assert isinstance(version, Version)
 
-        for k, v in self.config()["versions"].items():
-            if Version(k) == version:
-                return v["folder"]
-        raise KeyError(version)
+        if self.__folders is None:
+            self.__folders = {}
+            for k, v in self.config()["versions"].items():
+                # first entry wins, like a linear lookup would
+                self.__folders.setdefault(parse_version(k), v["folder"])
+        return self.__folders[version]
 
-    def for_version(self, version):
-        return VersionedRecipe(self, version)
+    def for_version(self, version, upstream=None):
+        return VersionedRecipe(self, version, upstream)
 
 
 class VersionedRecipe:
-    def __init__(self, recipe, version):
+    def __init__(self, recipe, version, upstream=None):
         assert isinstance(recipe, Recipe)
         self._recipe = recipe
+        self.cci_path = recipe.cci_path
         self.name = recipe.name
         self.path = recipe.path
         self.config_path = recipe.config_path
         self.version = version
-        self.__upstream = None
+        self.__upstream = upstream
+        self.__conandata = None
         self.__conanfile_class = None
+        self.__prs_opened = {}
+        self.__upstream_version = None
 
     @property
     def folder(self):
@@ -136,15 +152,16 @@ class VersionedRecipe:
         return self._recipe.config()
 
     def conandata(self):
-        if not os.path.exists(self.conandata_path):
-            raise RecipeError("no conandata.yml")
-        with open(self.conandata_path) as fil:
-            return yaml.load(fil)
+        if self.__conandata is None:
+            if not os.path.exists(self.conandata_path):
+                raise RecipeError("no conandata.yml")
+            self.__conandata = fast_load_file(self.conandata_path)
+        return self.__conandata
 
     def source(self):
         conandata = self.conandata()
         for k, v in conandata["sources"].items():
-            if Version(k) == self.version:
+            if parse_version(k) == self.version:
                 return v
         raise KeyError(self.version)
 
@@ -177,22 +194,34 @@ class VersionedRecipe:
         return self.__conanfile_class
 
     async def prs_opened_for(self, upstream_version: Version):
-        body_re = re.compile(self.name + r"/" + upstream_version.fixed)
-        title_re = re.compile(self.name + r".*" + upstream_version.fixed)
-
-        return [
-            LibPullRequest(
-                library=self.name,
-                version=upstream_version.fixed,
-                url=pr["html_url"],
-                number=pr["number"],
-            )
-            for pr in await cci_interface.pull_requests()
-            if body_re.search(pr.get("body") or "")
-            or title_re.search(pr.get("title") or "")
-        ]
+        if upstream_version.fixed not in self.__prs_opened:
+            body_re = re.compile(self.name + r"/" + upstream_version.fixed)
+            title_re = re.compile(self.name + r".*" + upstream_version.fixed)
+            # the index only holds words, other names are matched against all PRs
+            if RE_WORD.fullmatch(self.name):
+                prs = cci_interface.pull_requests_mentioning(self.name)
+            else:
+                prs = cci_interface.pull_requests()
+
+            self.__prs_opened[upstream_version.fixed] = [
+                LibPullRequest(
+                    library=self.name,
+                    version=upstream_version.fixed,
+                    url=pr["html_url"],
+                    number=pr["number"],
+                )
+                for pr in await prs
+                if body_re.search(pr.get("body") or "")
+                or title_re.search(pr.get("title") or "")
+            ]
+        return self.__prs_opened[upstream_version.fixed]
 
     async def upstream_version(self):
+        if self.__upstream_version is None:
+            self.__upstream_version = await self._find_upstream_version()
+        return self.__upstream_version
+
+    async def _find_upstream_version(self):
         upstream_versions = await self.upstream().versions()
         for version in upstream_versions:
             if version == self.version:
@@ -1,6 +1,14 @@
+import os
+import asyncio
+import functools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from asyncio.subprocess import create_subprocess_exec, PIPE
 
 
+_executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+
 class SubprocessError(RuntimeError):
     def __init__(self, process):
         super().__init__("subprocess error")
@@ -30,3 +38,16 @@ async def check_output(cmd, **kwargs):
     if code != 0:
         raise SubprocessError(process)
     return stdout.decode()
+
+
+async def run_in_thread(cmd, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, functools.partial(subprocess.run, cmd, check=False, **kwargs)
+    )
+
+
+async def check_call_in_thread(cmd, **kwargs):
+    process = await run_in_thread(cmd, **kwargs)
+    if process.returncode != 0:
+        raise SubprocessError(process)
@@ -1,5 +1,6 @@
 import os
 import re
+import sys
 import json
 import time
 import typing
@@ -8,23 +9,54 @@ import logging
 import datetime
 import traceback
 
-from .common import update_one_recipe, UpdateStatus, count_ccb_commits, TestStatus
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from .common import (
+    update_one_recipe,
+    UpdateStatus,
+    count_ccb_commits,
+    TestStatus,
+)
 from ..version import Version
 from ..recipe import Recipe, VersionedRecipe, get_recipes_list
-from ..git import branch_exists, remote_branch_exists, remove_branch
+from ..git import (
+    branch_ref,
+    remote_branch_ref,
+    refs_present,
+    remove_branch,
+    push_branch,
+    push_branches,
+)
 from ..utils import format_duration, SemaphoneStorage
 from ..cci import cci_interface
 
 
 update_sem = SemaphoneStorage(int(os.environ.get("CCB_UPDATE_CONCURRENCY", "16")))
+parse_sem = SemaphoneStorage(int(os.environ.get("CCB_PARSE_CONCURRENCY", "32")))
+# updated branches are pushed by batches of this size while updates go on
+PUSH_BATCH_SIZE = int(os.environ.get("CCB_PUSH_BATCH_SIZE", "16"))
 logger = logging.getLogger(__name__)
 RE_ERROR_METHOD = re.compile(r"Error in (\w+)\(\) method")
+# checked in order, before looking for the failing method
+ERROR_CATEGORIES = [
+    ("Invalid configuration:", "Invalid configuration"),
+    ("Hook validation failed", "Hook validation failed"),
+    ("Package recipe with version", "Bad recipe version"),
+    ("Patch already applied", "Patch already applied"),
+]
+METHOD_ERROR_CATEGORIES = {
+    "build": ("Failed to apply patch", "Patch does not apply"),
+    "source": ("FileNotFoundError", "Source not found"),
+}
 
 
 class RecipeInfo(typing.NamedTuple):
     recipe: VersionedRecipe
     new_upstream_version: Version
-    update_task: asyncio.Task
+    update: UpdateStatus
     details: typing.Optional[str]
 
 
@@ -50,13 +82,18 @@ async def auto_update_one_recipe(
             logger.info("%s: skipped (PR exists)", recipe.name)
             return UpdateStatus(updated=False, details="PR exists")
 
-        if await remote_branch_exists(recipe, branch_name, push_to):
+        local_ref = branch_ref(branch_name)
+        remote_ref = remote_branch_ref(branch_name, push_to)
+        present = await refs_present(recipe, [local_ref, remote_ref])
+        if remote_ref in present:
             if rebuild_if_exists:
-                if await branch_exists(recipe, branch_name):
+                if local_ref in present:
                     await remove_branch(recipe, branch_name)
             else:
                 logger.info("%s: skipped (remote branch exists)", recipe.name)
-                owner, repo = await cci_interface.owner_and_repo(recipe.path, push_to)
+                owner, repo = await cci_interface.owner_and_repo(
+                    recipe.cci_path, push_to
+                )
                 return UpdateStatus(
                     updated=True,
                     test_status=TestStatus(success=True, duration=0),
@@ -65,15 +102,16 @@ async def auto_update_one_recipe(
                     branch_remote_repo=repo,
                 )
 
+        # the branch is pushed with the others of its batch by push_updated_branches
         async with update_sem.get():
             return await update_one_recipe(
                 recipe=recipe,
                 new_upstream_version=new_upstream_version,
                 run_test=True,
-                push_to=push_to,
+                push_to=None,
                 force_push=True,
                 branch_name=branch_name,
-        )
+            )
     except Exception:
         logger.error(
             "%s: exception during update:\n%s",
@@ -83,60 +121,52 @@ async def auto_update_one_recipe(
         return UpdateStatus(updated=False, details=traceback.format_exc())
 
 
-def format_optional_date(maybe_date):
-    if not maybe_date:
-        return None
-    return maybe_date.isoformat()
-
-
-def get_error_category(error):
-    match_method = RE_ERROR_METHOD.search(error)
-    method = match_method.group(1) if match_method else None
+def print_status(status):
+    if orjson is None:
+        print(json.dumps(status, default=datetime.datetime.isoformat))
+        return
 
-    if "Invalid configuration:" in error:
-        return "Invalid configuration"
+    sys.stdout.flush()
+    sys.stdout.buffer.write(orjson.dumps(status, option=orjson.OPT_APPEND_NEWLINE))
+    sys.stdout.buffer.flush()
 
-    if "Hook validation failed" in error:
-        return "Hook validation failed"
 
-    if "Package recipe with version" in error:
-        return "Bad recipe version"
-
-    if "Patch already applied" in error:
-        return "Patch already applied"
-
-    if method == "build":
-        if "Failed to apply patch" in error:
-            return "Patch does not apply"
+def get_error_category(error):
+    for substring, category in ERROR_CATEGORIES:
+        if substring in error:
+            return category
 
-    if method == "source":
-        if "FileNotFoundError" in error:
-            return "Source not found"
+    match_method = RE_ERROR_METHOD.search(error)
+    if not match_method:
+        return "Other error"
 
-    if method:
-        return f"Error in {method}()"
+    method = match_method.group(1)
+    if method in METHOD_ERROR_CATEGORIES:
+        substring, category = METHOD_ERROR_CATEGORIES[method]
+        if substring in error:
+            return category
 
-    return "Other error"
+    return f"Error in {method}()"
 
 
 async def generate_recipe_update_status(info: RecipeInfo):
     recipe = info.recipe
     recipe_upstream_version = await recipe.upstream_version()
     new_upstream_version = info.new_upstream_version
-    update = info.update_task.result()
+    update = info.update
     return {
         "name": recipe.name,
         "homepage": recipe.homepage,
         "current": {
             "version": recipe.version.original,
             "tag": recipe_upstream_version.original,
-            "date": format_optional_date(recipe_upstream_version.meta.date),
+            "date": recipe_upstream_version.meta.date,
             "commit_count": recipe_upstream_version.meta.commit_count,
         },
         "new": {
             "version": new_upstream_version.fixed,
             "tag": new_upstream_version.original,
-            "date": format_optional_date(new_upstream_version.meta.date),
+            "date": new_upstream_version.meta.date,
             "commit_count": new_upstream_version.meta.commit_count,
         },
         "deprecated": recipe.deprecated,
@@ -172,16 +202,98 @@ async def generate_recipe_update_status(info: RecipeInfo):
     }
 
 
-async def recipe_info_details(recipe):
+def recipe_info_details(recipe, new_upstream_version):
     if not recipe.supported:
         return "Unsupported recipe"
-    if (await recipe.upstream().most_recent_version()).unknown:
+    if new_upstream_version.unknown:
         return "Unsupported upstream"
     return None
 
 
+async def auto_update_and_generate_status(
+    recipe, new_upstream_version, branch_prefix, push_to, rebuild_if_exists
+):
+    update = await auto_update_one_recipe(
+        recipe,
+        new_upstream_version,
+        branch_prefix,
+        push_to,
+        rebuild_if_exists,
+    )
+    status = await generate_recipe_update_status(
+        RecipeInfo(
+            recipe=recipe,
+            new_upstream_version=new_upstream_version,
+            update=update,
+            details=recipe_info_details(recipe, new_upstream_version),
+        )
+    )
+    # None when there is no new branch to push
+    to_push = recipe if update.updated and not update.branch_remote_owner else None
+    return status, to_push
+
+
+def mark_push_failed(status, details):
+    # reported like an update that failed, the branch was not pushed
+    status["updated_branch"] = {"owner": None, "repo": None, "branch": None}
+    status["details"] = details
+    status["test_error"] = None
+    status["test_error_category"] = None
+
+
+async def push_updated_branches(updates, push_to):
+    if not updates:
+        return
+
+    recipe = updates[0][1]
+    try:
+        owner, repo = await cci_interface.owner_and_repo(recipe.cci_path, push_to)
+    except Exception:
+        logger.error("exception during push:\n%s", traceback.format_exc())
+        for status, _ in updates:
+            mark_push_failed(status, traceback.format_exc())
+        return
+
+    branches = [status["updated_branch"]["branch"] for status, _ in updates]
+
+    logger.info("pushing %s branches", len(branches))
+    try:
+        await push_branches(recipe, push_to, branches, force=True)
+        pushed = updates
+    except Exception:
+        # a single rejected ref fails the atomic push, find out which
+        logger.warning("failed to push all branches at once, pushing one by one")
+        pushed = list()
+        for status, recipe in updates:
+            try:
+                await push_branch(
+                    recipe, push_to, status["updated_branch"]["branch"], force=True
+                )
+                pushed.append((status, recipe))
+            except Exception:
+                logger.error(
+                    "%s: exception during push:\n%s",
+                    recipe.name,
+                    traceback.format_exc(),
+                )
+                mark_push_failed(status, traceback.format_exc())
+
+    for status, _ in pushed:
+        status["updated_branch"]["owner"] = owner
+        status["updated_branch"]["repo"] = repo
+
+
+def load_recipe(recipe):
+    recipe = recipe.for_version(recipe.most_recent_version())
+    recipe.upstream()
+    return recipe
+
+
 async def auto_update_all_recipes(cci_path, branch_prefix, push_to, recipes, rebuild_all):
     t0 = time.time()
+    # fetch the opened PRs while recipes and upstreams are parsed,
+    # updates all need them
+    pull_requests_task = asyncio.create_task(cci_interface.pull_requests())
     ccb_commits_count = await count_ccb_commits(cci_path)
     logger.info("found %s CCB commits in CCI", ccb_commits_count)
     recipes = [
@@ -192,54 +304,68 @@ async def auto_update_all_recipes(cci_path, branch_prefix, push_to, recipes, reb
     recipes = list(sorted(recipes, key=lambda r: r.name))
 
     logger.info("parsing upstreams for %s recipes", len(recipes))
-    recipes = [recipe.for_version(recipe.most_recent_version()) for recipe in recipes]
-    parsing_tasks = [
-        asyncio.create_task(recipe.upstream().most_recent_version())
-        for recipe in recipes
-    ]
-
-    for i, coro in enumerate(asyncio.as_completed(parsing_tasks)):
-        await coro
-        logger.info("-- %s/%s parsing done --", i + 1, len(parsing_tasks))
-
-    new_upstream_versions = [t.result() for t in parsing_tasks]
-    logger.info(
-        "parsed %s upstreams in %s", len(recipes), format_duration(time.time() - t0)
+    # loading the recipe files is blocking, keep the event loop free meanwhile
+    loop = asyncio.get_running_loop()
+    recipes = await asyncio.gather(
+        *[loop.run_in_executor(None, load_recipe, recipe) for recipe in recipes]
     )
-    infos = [
-        RecipeInfo(
-            recipe=r,
-            new_upstream_version=v,
-            update_task=asyncio.create_task(
-                auto_update_one_recipe(
-                    r,
-                    v,
-                    branch_prefix,
-                    push_to,
-                    rebuild_all,
-                )
-            ),
-            details=await recipe_info_details(r),
+    parsed_count = 0
+    updated_count = 0
+    to_push = list()
+    push_lock = asyncio.Lock()
+
+    async def flush_pushes():
+        nonlocal to_push
+        batch, to_push = to_push, list()
+        # one push at a time, the next batch fills up meanwhile
+        async with push_lock:
+            await push_updated_branches(batch, push_to)
+
+    async def parse_and_update(recipe):
+        nonlocal parsed_count, updated_count
+        async with parse_sem.get():
+            new_upstream_version = await recipe.upstream().most_recent_version()
+        parsed_count += 1
+        logger.info("-- %s/%s parsing done --", parsed_count, len(recipes))
+        if parsed_count == len(recipes):
+            logger.info(
+                "parsed %s upstreams in %s",
+                len(recipes),
+                format_duration(time.time() - t0),
+            )
+
+        # start the update right away instead of waiting for all upstreams,
+        # each status is generated as soon as its update is done
+        result = await auto_update_and_generate_status(
+            recipe, new_upstream_version, branch_prefix, push_to, rebuild_all
         )
-        for (r, v) in zip(recipes, new_upstream_versions)
-    ]
+        updated_count += 1
+        logger.info("-- %s/%s update done --", updated_count, len(recipes))
+
+        status, to_push_recipe = result
+        if push_to and to_push_recipe is not None:
+            to_push.append((status, to_push_recipe))
+            if len(to_push) >= PUSH_BATCH_SIZE:
+                await flush_pushes()
+        return status
 
-    update_tasks = [info.update_task for info in infos]
-    for i, coro in enumerate(asyncio.as_completed(update_tasks)):
-        await coro
-        logger.info("-- %s/%s update done --", i + 1, len(update_tasks))
+    update_tasks = [asyncio.create_task(parse_and_update(r)) for r in recipes]
+    await pull_requests_task
+
+    # results come in the order of the recipes, sorted by name
+    recipes_status = await asyncio.gather(*update_tasks)
+    if to_push:
+        await flush_pushes()
 
     duration = time.time() - t0
 
     status = {
-        "date": datetime.datetime.now().isoformat(),
+        "date": datetime.datetime.now(),
         "duration": duration,
         "version": 3,
-        "recipes": await asyncio.gather(
-            *[generate_recipe_update_status(info) for info in infos]
-        ),
+        "recipes": recipes_status,
         "github_action_run_id": os.environ.get("GITHUB_RUN_ID", None),
         "ccb_commits_count": ccb_commits_count,
     }
-    print(json.dumps(status))
+    print_status(status)
     return 0
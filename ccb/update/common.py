@@ -1,16 +1,18 @@
 import os
 import re
-import copy
+import asyncio
 import time
+import collections
 import typing
 import logging
+import functools
 import subprocess
 
 from ..recipe import VersionedRecipe
-from ..yaml import yaml, DoubleQuotes
-from ..version import Version
+from ..yaml import DoubleQuotes, copy_node, load_file, dump_file, run_round_trip
+from ..version import Version, parse_version
 from ..cci import cci_interface
-from ..utils import format_duration, LockStorage
+from ..utils import format_duration, SemaphoneStorage
 from ..subprocess import run, call
 from ..git import (
     RecipeInWorktree,
@@ -21,20 +23,24 @@ from ..git import (
 
 
 logger = logging.getLogger(__name__)
-test_lock = LockStorage()
+test_sem = SemaphoneStorage(int(os.environ.get("CCB_TEST_CONCURRENCY", "1")))
 
 RE_HOOK_ERROR = re.compile(r"^\[HOOK.*\].*:\s*ERROR:\s*(.*)$", re.M)
-RE_TEST_ERRORS = [
-    re.compile(r"^ERROR:.*(Error in.*)", re.M | re.S),
-    re.compile(r"^ERROR:.*(Invalid configuration.*)", re.M | re.S),
-    re.compile(r"^ERROR:\s*(.*)", re.M | re.S),
-]
+RE_ERROR_LINE = re.compile(r"^ERROR:", re.M)
+# by priority: the details start at the last marker after the first ERROR line,
+# or else right after that "ERROR:"
+TEST_ERROR_MARKERS = ["Error in", "Invalid configuration"]
 
 RE_ALREADY_PATCHED = re.compile(r"WARN:\s*(.*):\s*already patched", re.M)
 RE_CREATE_ERRORS = [RE_ALREADY_PATCHED]
 
+# Lines that get_test_details may need, kept even when they leave the tail
+RE_DETAILS_LINE = re.compile(r"^(\[HOOK.*ERROR:|ERROR:)|WARN:.*already patched")
+TEST_OUTPUT_LINES = int(os.environ.get("CCB_TEST_OUTPUT_LINES", "5000"))
+
+# bytes: files are only decoded for the version, and rewritten as they were
 RE_CMAKELISTS_VERSION = re.compile(
-    r"(cmake_minimum_required\s*\(\s*VERSION\s*)([0-9\.]+)(\s*\))", re.I
+    rb"(cmake_minimum_required\s*\(\s*VERSION\s*)([0-9\.]+)(\s*\))", re.I
 )
 
 
@@ -53,20 +59,63 @@ class UpdateStatus(typing.NamedTuple):
     details: typing.Optional[str] = None
 
 
+class OutputTail:
+    def __init__(self, maxlen):
+        self.lines = collections.deque()
+        self.maxlen = maxlen
+        self.evicted_details = []
+
+    def append(self, line):
+        if len(self.lines) >= self.maxlen:
+            evicted = self.lines.popleft()
+            if RE_DETAILS_LINE.search(evicted):
+                self.evicted_details.append(evicted)
+        self.lines.append(line)
+
+    def text(self):
+        return "".join(self.evicted_details) + "".join(self.lines)
+
+
+async def read_output_tail(stream, maxlen, name=None):
+    # with a name, lines are also streamed live at debug level
+    debug = name is not None and logger.isEnabledFor(logging.DEBUG)
+    tail = OutputTail(maxlen)
+    pending = b""
+    while True:
+        data = await stream.read(1 << 16)
+        if not data:
+            break
+        lines = (pending + data).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            line = line.decode(errors="replace")
+            if debug:
+                logger.debug("%s: %s", name, line)
+            tail.append(line + "\n")
+    if pending:
+        pending = pending.decode(errors="replace")
+        if debug:
+            logger.debug("%s: %s", name, pending)
+        tail.append(pending)
+    return tail.text()
+
+
 def get_test_details(output):
-    matches = list(RE_HOOK_ERROR.finditer(output))
-    if matches:
-        errors = [match.group(1) for match in matches]
+    errors = [match.group(1) for match in RE_HOOK_ERROR.finditer(output)]
+    if errors:
         return "Hook validation failed:\n" + "\n".join(errors)
 
-    for regex in RE_TEST_ERRORS:
-        match = regex.search(output)
-        if match:
-            return match.group(1)
-
-    matches = list(RE_ALREADY_PATCHED.finditer(output))
-    if matches:
-        patches = {m.group(1) for m in matches}
+    error_line = RE_ERROR_LINE.search(output)
+    if error_line:
+        error_output = output[error_line.end() :]
+        for marker in TEST_ERROR_MARKERS:
+            idx = error_output.rfind(marker)
+            if idx >= 0:
+                return error_output[idx:]
+        return error_output.lstrip()
+
+    patches = {match.group(1) for match in RE_ALREADY_PATCHED.finditer(output)}
+    if patches:
         return "Patch already applied:\n" + "\n".join(patches)
 
     return "no details"
@@ -79,11 +128,17 @@ async def count_ccb_commits(cci_path):
 
 
 async def patch_cmakelists_version(recipe):
+    # small blocking file operations, keep them off the event loop
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, _patch_cmakelists_version, recipe)
+
+
+def _patch_cmakelists_version(recipe):
     if not os.path.exists(recipe.cmakelists_path):
         logger.warning("%s: CMakeLists.txt not found", recipe.name)
         return
 
-    with open(recipe.cmakelists_path) as f:
+    with open(recipe.cmakelists_path, "rb") as f:
         content = f.read()
 
     match = RE_CMAKELISTS_VERSION.search(content)
@@ -91,47 +146,63 @@ async def patch_cmakelists_version(recipe):
         logger.warning("%s: CMake minimum version not found", recipe.name)
         return
 
-    version = Version(match.group(2))
+    version = Version(match.group(2).decode())
     if version >= Version("3.1"):
         return
 
     logger.info("%s: updating CMake minimum version", recipe.name)
-    content = RE_CMAKELISTS_VERSION.sub(r"\g<1>3.1\g<3>", content)
+    content = RE_CMAKELISTS_VERSION.sub(rb"\g<1>3.1\g<3>", content)
 
-    with open(recipe.cmakelists_path, "w") as f:
+    with open(recipe.cmakelists_path, "wb") as f:
         f.write(content)
 
 
+def smart_insert(container, key, value):
+    # replace what a previous attempt may have left
+    if key in container:
+        del container[key]
+    if not container:
+        container.insert(0, key, value)
+        return
+    versions = [parse_version(ckey) for ckey in container.keys()]
+    version = parse_version(key)
+    ascending = versions[0] < versions[-1]
+    # a linear scan: the containers are not always sorted, and checking that
+    # they are would cost as many comparisons as the scan itself
+    insert_idx = len(versions)
+    for idx, cversion in enumerate(versions):
+        if (cversion > version) if ascending else (cversion < version):
+            insert_idx = idx
+            break
+    container.insert(insert_idx, key, value)
+
+
 async def add_version(recipe, upstream_version):
     conan_version = upstream_version.fixed
     url = recipe.upstream().source_url(upstream_version)
 
-    logger.debug("%s: downloading source and computing its sha256 digest", recipe.name)
-    hash_digest = await recipe.upstream().source_sha256_digest(upstream_version)
-
-    def smart_insert(container, key, value):
-        container_keys = list(container.keys())
-        ascending = Version(container_keys[0]) < Version(container_keys[-1])
-        insert_idx = len(container_keys)
-        if ascending:
-            for idx, ckey in enumerate(container_keys):
-                if Version(ckey) > Version(key):
-                    insert_idx = idx
-                    break
-            container.insert(insert_idx, key, value)
-        else:
-            for idx, ckey in enumerate(container_keys):
-                if Version(ckey) < Version(key):
-                    insert_idx = idx
-                    break
-            container.insert(insert_idx, key, value)
-
     logger.debug("%s: patching files", recipe.name)
-    config = recipe.config()
+    config = await run_round_trip(load_file, recipe.config_path)
     smart_insert(config["versions"], DoubleQuotes(conan_version), {})
     config["versions"][conan_version]["folder"] = recipe.folder
 
-    conandata = recipe.conandata()
+    conandata = await run_round_trip(load_file, recipe.conandata_path)
+
+    # an entry left for this source by a previous attempt has the right digest,
+    # entries listing several mirrors or tarballs are downloaded again
+    existing_source = conandata["sources"].get(conan_version)
+    if (
+        isinstance(existing_source, dict)
+        and existing_source.get("url") == url
+        and existing_source.get("sha256")
+    ):
+        hash_digest = str(existing_source["sha256"])
+    else:
+        logger.debug(
+            "%s: downloading source and computing its sha256 digest", recipe.name
+        )
+        hash_digest = await recipe.upstream().source_sha256_digest(upstream_version)
+
     smart_insert(conandata["sources"], DoubleQuotes(conan_version), {})
     conandata["sources"][conan_version]["url"] = DoubleQuotes(url)
     conandata["sources"][conan_version]["sha256"] = DoubleQuotes(hash_digest)
@@ -141,23 +212,24 @@ async def add_version(recipe, upstream_version):
         smart_insert(
             conandata["patches"],
             DoubleQuotes(conan_version),
-            copy.deepcopy(most_recent_patches),
+            copy_node(most_recent_patches),
         )
 
-    with open(recipe.config_path, "w") as fil:
-        yaml.dump(config, fil)
-
-    with open(recipe.conandata_path, "w") as fil:
-        yaml.dump(conandata, fil)
+    await run_round_trip(dump_file, config, recipe.config_path)
+    await run_round_trip(dump_file, conandata, recipe.conandata_path)
 
     return conan_version
 
 
+@functools.lru_cache(maxsize=None)
+def get_test_env():
+    return {**os.environ, "CONAN_HOOK_ERROR_LEVEL": "40"}
+
+
 async def test_recipe(recipe, version_str):
-    env = os.environ.copy()
-    env["CONAN_HOOK_ERROR_LEVEL"] = "40"
+    env = get_test_env()
 
-    async with test_lock.get():
+    async with test_sem.get():
         t0 = time.time()
         logger.info("%s: running test", recipe.name)
         reference = f"{recipe.name}/{version_str}@"
@@ -168,19 +240,26 @@ async def test_recipe(recipe, version_str):
             stderr=subprocess.STDOUT,
             cwd=recipe.folder_path,
         )
-        output, _ = await process.communicate()
-        output = output.decode()
-        code = await process.wait()
-        duration = time.time() - t0
+        try:
+            output = await read_output_tail(
+                process.stdout, TEST_OUTPUT_LINES, recipe.name
+            )
+        finally:
+            # drain what was not read, conan would block on a full pipe
+            await process.communicate()
+            duration = time.time() - t0
 
-        cleanup_code = await call(
-            ["conan", "remove", reference, "-b", "-f", "-p", "-s"]
-        )
-        if cleanup_code != 0:
-            logger.warning("%s: failed to cleanup after test", recipe.name)
+            cleanup_code = await call(
+                ["conan", "remove", reference, "-b", "-f", "-p", "-s"]
+            )
+            if cleanup_code != 0:
+                logger.warning("%s: failed to cleanup after test", recipe.name)
+        code = process.returncode
 
     if code != 0:
-        logger.info(output)
+        if not logger.isEnabledFor(logging.DEBUG):
+            # otherwise it has already been streamed
+            logger.info(output)
         logger.error(
             "%s: test failed in %s",
             recipe.name,
@@ -246,25 +325,26 @@ async def update_one_recipe(
             "Find more updatable recipes in the [GitHub Pages](https://qchateau.github.io/conan-center-bot/)",
         )
 
-        if push_to:
-            logger.info("%s: pushing", recipe.name)
-            owner, repo = await cci_interface.owner_and_repo(recipe.path, push_to)
-            await push_branch(new_recipe, push_to, branch_name, force_push)
-        else:
-            owner = repo = None
-
     logger.info(
-        "%s: created version %s in branch %s (%s)",
+        "%s: created version %s in branch %s",
         recipe.name,
         conan_version,
         branch_name,
-        "pushed" if push_to else "not pushed",
     )
 
-    return UpdateStatus(
+    status = UpdateStatus(
         updated=True,
         test_status=test_status,
         branch_name=branch_name,
-        branch_remote_owner=owner,
-        branch_remote_repo=repo,
     )
+    if push_to:
+        status = await push_update(recipe, status, push_to, force_push)
+    return status
+
+
+async def push_update(recipe, status, push_to, force_push) -> UpdateStatus:
+    # the branch lives in the main repository, the worktree is not needed
+    logger.info("%s: pushing branch %s", recipe.name, status.branch_name)
+    owner, repo = await cci_interface.owner_and_repo(recipe.cci_path, push_to)
+    await push_branch(recipe, push_to, status.branch_name, force_push)
+    return status._replace(branch_remote_owner=owner, branch_remote_repo=repo)
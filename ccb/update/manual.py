@@ -1,10 +1,14 @@
+import typing
+import asyncio
 import logging
 
-from ..recipe import Recipe, RecipeError
+from ..recipe import Recipe, RecipeError, VersionedRecipe
+from ..version import Version
 from ..utils import yn_question
 from ..git import (
-    branch_exists,
-    remote_branch_exists,
+    refs_present,
+    branch_ref,
+    remote_branch_ref,
     remove_branch,
 )
 from .common import update_one_recipe
@@ -25,6 +29,13 @@ class RecipeNotUpdatable(UpdateError):
     pass
 
 
+class ManualUpdate(typing.NamedTuple):
+    recipe: VersionedRecipe
+    upstream_version: Version
+    branch_name: str
+    force_push: bool
+
+
 async def get_most_recent_upstream_version(recipe):
     upstream_version = await recipe.upstream().most_recent_version()
     if upstream_version.unknown:
@@ -51,7 +62,7 @@ async def get_user_choice_upstream_version(recipe):
     if not versions:
         raise UpstreamNotSupported("no upstream versions found")
 
-    print("Choose an upstream version:")
+    print(f"Choose an upstream version for {recipe.name}:")
     for i, v in enumerate(versions):
         print(f"{i:3d}) {v}")
 
@@ -59,23 +70,23 @@ async def get_user_choice_upstream_version(recipe):
     while upstream_version is None:
         try:
             upstream_version = versions[int(input("Choice: "))]
-        except (ValueError, KeyError):
+        except (ValueError, IndexError):
             pass
     return upstream_version
 
 
-async def manual_update_one_recipe(
-    cci_path,
-    recipe_name,
+def load_recipe(cci_path, recipe_name):
+    recipe = Recipe(cci_path, recipe_name)
+    return recipe.for_version(recipe.most_recent_version())
+
+
+async def prepare_manual_update(
+    recipe,
     choose_version,
-    run_test,
     push_to,
     force,
     branch_prefix,
 ):
-    recipe = Recipe(cci_path, recipe_name)
-    recipe = recipe.for_version(recipe.most_recent_version())
-
     if choose_version:
         upstream_version = await get_user_choice_upstream_version(recipe)
     else:
@@ -83,38 +94,54 @@ async def manual_update_one_recipe(
 
     conan_version = upstream_version.fixed
     branch_name = f"{branch_prefix}{recipe.name}-{conan_version}"
-    if await branch_exists(recipe, branch_name):
+    local_ref = branch_ref(branch_name)
+    refs = [local_ref]
+    if push_to:
+        remote_ref = remote_branch_ref(branch_name, push_to)
+        refs.append(remote_ref)
+    present = await refs_present(recipe, refs)
+    if local_ref in present:
         if not force:
             force = yn_question(
                 f"Branch '{branch_name}' already exists, overwrite ?", False
             )
         if not force:
-            return
+            return None
         await remove_branch(recipe, branch_name)
 
     force_push = force
-    if push_to and await remote_branch_exists(recipe, branch_name, push_to):
+    if push_to and remote_ref in present:
         if not force_push:
             force_push = yn_question(
                 f"Remote branch '{push_to}/{branch_name}' already exists, overwrite ?",
                 False,
             )
         if not force_push:
-            return
+            return None
+
+    return ManualUpdate(
+        recipe=recipe,
+        upstream_version=upstream_version,
+        branch_name=branch_name,
+        force_push=force_push,
+    )
+
 
+async def manual_update_one_recipe(update, run_test, push_to):
+    recipe = update.recipe
     status = await update_one_recipe(
         recipe=recipe,
-        new_upstream_version=upstream_version,
+        new_upstream_version=update.upstream_version,
         run_test=run_test,
         push_to=push_to,
-        force_push=force_push,
-        branch_name=branch_name,
+        force_push=update.force_push,
+        branch_name=update.branch_name,
     )
 
     if not status.updated:
-        logger.info("%s: skipped (%s)", recipe_name, status.details)
+        logger.info("%s: skipped (%s)", recipe.name, status.details)
     elif status.test_ran and not status.test_success:
-        logger.error("%s: test failed:\n%s", recipe_name, status.details)
+        logger.error("%s: test failed:\n%s", recipe.name, status.details)
 
 
 async def manual_update_recipes(
@@ -127,19 +154,45 @@ async def manual_update_recipes(
     branch_prefix,
 ):
     ok = True
+    loaded = list()
     for recipe_name in recipes:
         try:
-            await manual_update_one_recipe(
-                cci_path=cci_path,
-                recipe_name=recipe_name,
+            loaded.append(load_recipe(cci_path, recipe_name))
+        except RecipeError as exc:
+            logger.error("%s: %s", recipe_name, str(exc))
+            ok = False
+
+    # parse all upstreams beforehand, the questions then follow one another
+    await asyncio.gather(*(recipe.upstream().versions() for recipe in loaded))
+
+    # ask everything before starting any update: log lines and conan output
+    # would otherwise be printed in the middle of the questions
+    updates = list()
+    for recipe in loaded:
+        try:
+            pending = await prepare_manual_update(
+                recipe=recipe,
                 choose_version=choose_version,
-                run_test=run_test,
                 push_to=push_to,
                 force=force,
                 branch_prefix=branch_prefix,
             )
         except (UpdateError, RecipeError) as exc:
-            logger.error("%s: %s", recipe_name, str(exc))
+            logger.error("%s: %s", recipe.name, str(exc))
             ok = False
+            continue
+        if pending is not None:
+            updates.append(pending)
+
+    async def run_update(update):
+        try:
+            await manual_update_one_recipe(update, run_test, push_to)
+            return True
+        except (UpdateError, RecipeError) as exc:
+            logger.error("%s: %s", update.recipe.name, str(exc))
+            return False
 
-    return 0 if ok else 1
+    # recipes are updated in their own worktree, the tests are still
+    # limited by CCB_TEST_CONCURRENCY
+    results = await asyncio.gather(*(run_update(u) for u in updates))
+    return 0 if ok and all(results) else 1
@@ -1,11 +1,17 @@
 import re
 import os
 import abc
+import asyncio
 import time
 import typing
 import datetime
+import shutil
 import tempfile
+import subprocess
+import base64
+import binascii
 import hashlib
+import collections
 import traceback
 import logging
 import aiohttp
@@ -17,8 +23,11 @@ from .project_specifics import (
     PROJECT_TAGS_WHITELIST,
     PROJECT_TAGS_FIXERS,
 )
-from .subprocess import check_output, check_call
-from .utils import SemaphoneStorage, format_duration
+from .subprocess import run, check_output, check_call, SubprocessError
+from .utils import SemaphoneStorage, LockStorage, format_duration
+from .cache import DiskCache
+from .http_session import client_session
+from .github import get_github_token, get_all_pages
 
 
 logger = logging.getLogger(__name__)
@@ -29,6 +38,83 @@ class _Unsupported(RuntimeError):
 
 
 clone_sem = SemaphoneStorage(int(os.environ.get("CCB_CLONE_CONCURRENCY", "3")))
+count_sem = SemaphoneStorage(int(os.environ.get("CCB_COUNT_CONCURRENCY", "8")))
+download_sem = SemaphoneStorage(int(os.environ.get("CCB_DOWNLOAD_CONCURRENCY", "8")))
+# Keep the clones to only fetch new objects in the next runs, empty to disable.
+# Not part of CCB_CACHE_DIR by default: all the clones can weigh several GB
+REPOS_CACHE_DIR = os.environ.get("CCB_REPOS_CACHE_DIR", "")
+repo_locks = collections.defaultdict(LockStorage)
+tags_cache = DiskCache("tags")
+sha256_cache = DiskCache("sha256")
+gnome_cache = DiskCache("gnome")
+# sources are read and hashed by 1 MB: few loop iterations and executor jobs
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+RE_SHA256 = re.compile(r"[0-9a-fA-F]{64}")
+# the repository name ends at the next path, query or fragment, without ".git"
+GITHUB_URL_RE = re.compile(
+    r"https?://github\.com/([^/]+)/([^/#?]+?)(?:\.git)?(?:[/#?]|$)"
+)
+
+
+def _combine_regexes(regexes):
+    # a single match for all the patterns, each with the flags it was compiled with
+    patterns = list()
+    for regex in regexes:
+        flags = "".join(
+            letter
+            for letter, flag in (("i", re.I), ("m", re.M), ("s", re.S), ("x", re.X))
+            if regex.flags & flag
+        )
+        patterns.append(f"(?{flags}:{regex.pattern})")
+    if not patterns:
+        return None
+    # project blacklists include the global one
+    return re.compile("|".join(dict.fromkeys(patterns)))
+
+
+def _header_sha256(headers):
+    # some servers send the digest of the content (Artifactory, RFC 3230),
+    # it only checks the download: what goes in conandata.yml is always hashed
+    # here. ETags are not used, they are not guaranteed to be a digest
+    checksum = headers.get("X-Checksum-Sha256", "")
+    if RE_SHA256.fullmatch(checksum):
+        return checksum.lower()
+    for digest in headers.getall("Digest", []):
+        for value in digest.split(","):
+            algorithm, _, encoded = value.strip().partition("=")
+            if algorithm.lower() == "sha-256":
+                try:
+                    decoded = base64.b64decode(encoded, validate=True)
+                except binascii.Error:
+                    continue
+                if len(decoded) == hashlib.sha256().digest_size:
+                    return decoded.hex()
+    return None
+
+
+def _strong_etag(etag):
+    # weak ETags (W/"...") only promise an equivalent content
+    return bool(etag) and not etag.startswith("W/")
+
+
+async def _stream_sha256(stream):
+    # hash in a thread while the next chunks are received, so large archives
+    # do not block the event loop. Updates must still happen in order
+    loop = asyncio.get_running_loop()
+    sha256 = hashlib.sha256()
+    hashing = None
+    buffer = bytearray()
+    async for data in stream.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+        buffer += data
+        if len(buffer) >= DOWNLOAD_CHUNK_SIZE:
+            if hashing is not None:
+                await hashing
+            hashing = loop.run_in_executor(None, sha256.update, buffer)
+            buffer = bytearray()
+    if hashing is not None:
+        await hashing
+    sha256.update(buffer)
+    return sha256.hexdigest()
 
 
 def get_upstream_project(recipe):
@@ -46,6 +132,7 @@ class UpstreamProject(abc.ABC):
     def __init__(self, recipe):
         self.recipe = recipe
         self.__sha256 = {}
+        self.__most_recent_version = None
 
     @property
     def homepage(self) -> str:
@@ -56,27 +143,49 @@ class UpstreamProject(abc.ABC):
         pass
 
     async def most_recent_version(self) -> Version:
-        versions = await self.versions()
-        if not versions:
-            return Version()
-        return sorted(versions)[-1]
+        if self.__most_recent_version is None:
+            versions = await self.versions()
+            if not versions:
+                self.__most_recent_version = Version()
+            else:
+                # the last of equal versions, as sorting would
+                self.__most_recent_version = max(reversed(versions))
+        return self.__most_recent_version
 
     @abc.abstractmethod
     def source_url(self, version) -> str:
         pass
 
     async def source_sha256_digest(self, version):
-        if version not in self.__sha256:
-            url = self.source_url(version)
-            if not url:
-                return None
-            sha256 = hashlib.sha256()
-            async with aiohttp.ClientSession(raise_for_status=True) as client:
-                async with client.get(url) as resp:
-                    async for data in resp.content.iter_any():
-                        sha256.update(data)
-            self.__sha256[version] = sha256.hexdigest()
-        return self.__sha256[version]
+        url = self.source_url(version)
+        if not url:
+            return None
+        if url not in self.__sha256:
+            self.__sha256[url] = await self._download_sha256(url)
+        return self.__sha256[url]
+
+    @staticmethod
+    async def _download_sha256(url):
+        # the digest of the previous runs is reused when the server answers that
+        # the source did not change. Only strong ETags promise the same bytes,
+        # without one the source is downloaded and hashed again
+        cached = sha256_cache.get(url)
+        if not isinstance(cached, dict) or not _strong_etag(cached.get("etag")):
+            cached = None
+        headers = {"If-None-Match": cached["etag"]} if cached else {}
+        async with download_sem.get(), client_session().get(
+            url, headers=headers
+        ) as resp:
+            if cached and resp.status == 304:
+                return cached["sha256"]
+            etag = resp.headers.get("ETag")
+            expected = _header_sha256(resp.headers)
+            digest = await _stream_sha256(resp.content)
+        if expected is not None and digest != expected:
+            raise RuntimeError(f"{url}: sha256 is {digest}, the server sent {expected}")
+        if _strong_etag(etag):
+            sha256_cache.set(url, {"sha256": digest, "etag": etag})
+        return digest
 
 
 class UnsupportedProject(UpstreamProject):
@@ -93,12 +202,16 @@ class GitProject(UpstreamProject):
         commit_count: int
         date: typing.Optional[datetime.datetime] = None
 
+    _ahead_behind = None
+
     def __init__(self, recipe, git_url):
         super().__init__(recipe)
         self.git_url = git_url
         self.whitelist = PROJECT_TAGS_WHITELIST.get(recipe.name, [])
         self.blacklist = TAGS_BLACKLIST + PROJECT_TAGS_BLACKLIST.get(recipe.name, [])
         self.fixer = PROJECT_TAGS_FIXERS.get(recipe.name, None)
+        self.__whitelist_re = _combine_regexes(self.whitelist)
+        self.__blacklist_re = _combine_regexes(self.blacklist)
         self.__versions = None
 
     async def versions(self):
@@ -114,16 +227,40 @@ class GitProject(UpstreamProject):
     async def _clone_and_parse_git_repo(self):
         async with clone_sem.get():
             t0 = time.time()
-            with tempfile.TemporaryDirectory(prefix=f"ccb-{self.recipe.name}") as tmp:
-                logger.info("%s: cloning repository %s", self.recipe.name, self.git_url)
-                env = os.environ.copy()
-                env["GIT_TERMINAL_PROMPT"] = "0"
-                await check_call(
-                    ["git", "clone", "-q", "--filter=tree:0", "-n", self.git_url, tmp],
-                    env=env,
+            env = os.environ.copy()
+            env["GIT_TERMINAL_PROMPT"] = "0"
+
+            # listing the remote refs is much cheaper than a clone: when they did not
+            # change since the last run, the tags parsed back then are still valid
+            fingerprint = await self._remote_fingerprint(env)
+            cached = tags_cache.get(self.git_url)
+            if cached is not None and cached["fingerprint"] == fingerprint:
+                logger.info(
+                    "%s: repository unchanged, using cached tags", self.recipe.name
                 )
-                logger.info("%s: parsing repository", self.recipe.name)
-                await self._parse_git_repo(tmp)
+                self._set_versions(
+                    self._TagData(
+                        name,
+                        commit_count,
+                        datetime.datetime.fromisoformat(date) if date else None,
+                    )
+                    for name, commit_count, date in cached["tags"]
+                )
+                return
+
+            if REPOS_CACHE_DIR:
+                # recipes may share a repository
+                async with repo_locks[self.git_url].get():
+                    git_dir = await self._update_cached_clone(env)
+                    logger.info("%s: parsing repository", self.recipe.name)
+                    tags_data = await self._parse_git_repo(git_dir)
+            else:
+                with tempfile.TemporaryDirectory(
+                    prefix=f"ccb-{self.recipe.name}"
+                ) as tmp:
+                    await self._clone(tmp, env)
+                    logger.info("%s: parsing repository", self.recipe.name)
+                    tags_data = await self._parse_git_repo(tmp)
             duration = time.time() - t0
             logger.info(
                 "%s: parsed repository in %s",
@@ -131,14 +268,113 @@ class GitProject(UpstreamProject):
                 format_duration(duration),
             )
 
+        tags_cache.set(
+            self.git_url,
+            {
+                "fingerprint": fingerprint,
+                "tags": [
+                    (t.name, t.commit_count, t.date.isoformat() if t.date else None)
+                    for t in tags_data
+                ],
+            },
+        )
+
+    async def _clone(self, git_dir, env):
+        # only the tags and their history are needed, not the other branches
+        logger.info("%s: cloning repository %s", self.recipe.name, self.git_url)
+        await check_call(["git", "init", "-q", "--bare", git_dir], env=env)
+        await check_call(
+            ["git", "remote", "add", "origin", self.git_url], cwd=git_dir, env=env
+        )
+        await check_call(
+            [
+                "git",
+                "fetch",
+                "-q",
+                "--filter=tree:0",
+                "origin",
+                "+refs/tags/*:refs/tags/*",
+            ],
+            cwd=git_dir,
+            env=env,
+        )
+
+    async def _update_cached_clone(self, env):
+        git_dir = os.path.join(
+            REPOS_CACHE_DIR, hashlib.sha256(self.git_url.encode()).hexdigest()
+        )
+        if os.path.isdir(git_dir):
+            logger.info("%s: fetching repository %s", self.recipe.name, self.git_url)
+            try:
+                await check_call(
+                    [
+                        "git",
+                        "fetch",
+                        "-q",
+                        "--prune",
+                        "--force",
+                        "origin",
+                        "+refs/tags/*:refs/tags/*",
+                    ],
+                    cwd=git_dir,
+                    env=env,
+                )
+                return git_dir
+            except SubprocessError:
+                logger.info("%s: cannot fetch, cloning again", self.recipe.name)
+                shutil.rmtree(git_dir, ignore_errors=True)
+
+        # clone next to it and move it in place, a failed clone is not reused
+        os.makedirs(REPOS_CACHE_DIR, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=f"ccb-{self.recipe.name}", dir=REPOS_CACHE_DIR)
+        try:
+            await self._clone(tmp, env)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        os.replace(tmp, git_dir)
+        return git_dir
+
+    async def _remote_fingerprint(self, env):
+        # hashed as it is received, the refs of big repositories weigh megabytes.
+        # Only the tags are cloned and parsed, pushes to branches do not matter
+        sha256 = self._fingerprint_hash()
+        process = await run(
+            ["git", "ls-remote", "--tags", "--refs", self.git_url],
+            stdout=subprocess.PIPE,
+            env=env,
+        )
+        while True:
+            data = await process.stdout.read(1 << 16)
+            if not data:
+                break
+            sha256.update(data)
+        if await process.wait() != 0:
+            raise SubprocessError(process)
+        return sha256.hexdigest()
+
+    def _fingerprint(self, refs):
+        sha256 = self._fingerprint_hash()
+        sha256.update(refs.encode())
+        return sha256.hexdigest()
+
+    def _fingerprint_hash(self):
+        # filters are applied while parsing: changing them invalidates the cache
+        filters = [r.pattern for r in self.whitelist + self.blacklist]
+        return hashlib.sha256(repr(filters).encode())
+
     async def _parse_git_repo(self, git_dir):
         tags_data = await self._parse_tags(git_dir)
-        logger.debug(
-            "%s: found tags: %s",
-            self.recipe.name,
-            [t.name for t in tags_data],
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "%s: found tags: %s",
+                self.recipe.name,
+                [t.name for t in tags_data],
+            )
+        self._set_versions(tags_data)
+        return tags_data
 
+    def _set_versions(self, tags_data):
         self.__versions = list()
         for tag_data in tags_data:
             meta = VersionMeta(date=tag_data.date, commit_count=tag_data.commit_count)
@@ -152,15 +388,20 @@ class GitProject(UpstreamProject):
                 "git",
                 "for-each-ref",
                 "--format",
-                "%(refname) %(taggerdate)%(committerdate)",
+                "%(refname) %(taggerdate:iso-strict)%(committerdate:iso-strict)",
                 "refs/tags",
             ],
             cwd=git_dir,
         )
 
         tag_data = list()
+        lines = output.splitlines()
+        if not lines:
+            return tag_data
+        # the repository has no HEAD, count relatively to any tag
+        commit_counts = await self._count_tags_commits(git_dir, lines[0].split(" ")[0])
 
-        for line in output.splitlines():
+        for line in lines:
             ref, date = line.split(" ", 1)
             tag = ref[10:]
 
@@ -168,7 +409,10 @@ class GitProject(UpstreamProject):
                 continue
 
             try:
-                date = datetime.datetime.strptime(date, "%c %z")
+                # much faster than strptime, and does not depend on the locale
+                if date.endswith("Z"):
+                    date = date[:-1] + "+00:00"
+                date = datetime.datetime.fromisoformat(date)
             except ValueError as exc:
                 logger.debug(
                     "%s: ignored tag '%s' date: %s",
@@ -178,13 +422,71 @@ class GitProject(UpstreamProject):
                 )
                 date = None
 
-            # don't gather, that's way too many sub-processes
-            commit_count = await self._count_commits(ref, git_dir)
+            tag_data.append(self._TagData(tag, commit_counts.get(ref), date))
+
+        # the remaining tags are counted one by one, a few at a time
+        async def count_commits(tag):
+            async with count_sem.get():
+                return await self._count_commits(f"refs/tags/{tag}", git_dir)
 
-            tag_data.append(self._TagData(tag, commit_count, date))
+        missing = [i for i, t in enumerate(tag_data) if t.commit_count is None]
+        tasks = [
+            asyncio.ensure_future(count_commits(tag_data[i].name)) for i in missing
+        ]
+        try:
+            counts = await asyncio.gather(*tasks)
+        finally:
+            # after an error, do not keep counting for a result that is lost
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for i, commit_count in zip(missing, counts):
+            tag_data[i] = tag_data[i]._replace(commit_count=commit_count)
 
         return tag_data
 
+    @classmethod
+    async def _count_tags_commits(cls, git_dir, base_ref):
+        # a single process for all the tags: the commits of a tag are the ones
+        # of the base, plus the ones ahead of it, minus the ones behind.
+        # Needs git 2.41, tags are counted one by one otherwise
+        if not await cls._has_ahead_behind():
+            return {}
+        try:
+            base_count = await cls._count_commits(base_ref, git_dir)
+            output = await check_output(
+                [
+                    "git",
+                    "for-each-ref",
+                    "--format",
+                    f"%(refname) %(ahead-behind:{base_ref})",
+                    "refs/tags",
+                ],
+                cwd=git_dir,
+                stderr=subprocess.DEVNULL,
+            )
+        except SubprocessError:
+            return {}
+
+        commit_counts = dict()
+        for line in output.splitlines():
+            ref, _, ahead_behind = line.partition(" ")
+            if ahead_behind:
+                ahead, behind = ahead_behind.split()
+                commit_counts[ref] = base_count + int(ahead) - int(behind)
+        return commit_counts
+
+    @classmethod
+    async def _has_ahead_behind(cls):
+        # checked once, not to spawn a failing process for each repository
+        if cls._ahead_behind is None:
+            output = await check_output(["git", "version"])
+            match = re.search(r"([0-9]+)\.([0-9]+)", output)
+            cls._ahead_behind = bool(match) and (
+                tuple(int(v) for v in match.groups()) >= (2, 41)
+            )
+        return cls._ahead_behind
+
     @staticmethod
     async def _count_commits(ref, git_dir):
         output = await check_output(["git", "rev-list", "--count", ref], cwd=git_dir)
@@ -192,33 +494,32 @@ class GitProject(UpstreamProject):
 
     def _valid_tags(self, tag):
         if self.whitelist:
-            if any(regex.match(tag) for regex in self.whitelist):
+            if self.__whitelist_re.match(tag):
                 return True
             else:
-                logger.debug(
-                    "%s: tag %s ignored because it does not match any of %s",
-                    self.recipe.name,
-                    tag,
-                    list(regex.pattern for regex in self.whitelist),
-                )
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "%s: tag %s ignored because it does not match any of %s",
+                        self.recipe.name,
+                        tag,
+                        list(regex.pattern for regex in self.whitelist),
+                    )
                 return False
         else:
-            for regex in self.blacklist:
-                if regex.match(tag):
+            if self.__blacklist_re is not None and self.__blacklist_re.match(tag):
+                if logger.isEnabledFor(logging.DEBUG):
+                    regex = next(r for r in self.blacklist if r.match(tag))
                     logger.debug(
                         "%s: tag %s ignored because it matches regex %s",
                         self.recipe.name,
                         tag,
                         regex.pattern,
                     )
-                    return False
+                return False
             return True
 
 
 class GithubProject(GitProject):
-    HOMEPAGE_RE = re.compile(r"https?://github.com/([^/]+)/([^/]+)")
-    SOURCE_URL_RE = re.compile(r"https?://github.com/([^/]+)/([^/]+)")
-
     def __init__(self, recipe):
         owner, repo = self._get_owner_repo(recipe)
         git_url = f"https://github.com/{owner}/{repo}.git"
@@ -232,11 +533,28 @@ class GithubProject(GitProject):
             return None
         return f"https://github.com/{self.owner}/{self.repo}/archive/{version.original}.tar.gz"
 
+    async def _remote_fingerprint(self, env):
+        # the API spares a git process per repository, but is rate limited
+        # without a token
+        if not get_github_token():
+            return await super()._remote_fingerprint(env)
+        try:
+            tags = await get_all_pages(
+                f"https://api.github.com/repos/{self.owner}/{self.repo}/tags",
+                cached=True,
+            )
+        except aiohttp.ClientError as exc:
+            logger.debug("%s: cannot list tags: %s", self.recipe.name, exc)
+            return await super()._remote_fingerprint(env)
+        return self._fingerprint(
+            "".join(f"{tag['commit']['sha']}\t{tag['name']}\n" for tag in tags)
+        )
+
     @classmethod
     def _get_owner_repo(cls, recipe):
         try:
             url = recipe.source()["url"]
-            match = cls.SOURCE_URL_RE.match(url)
+            match = GITHUB_URL_RE.match(url)
             if match:
                 return match.groups()
         except Exception as exc:
@@ -315,18 +633,29 @@ class GnomeProject(UpstreamProject):
     async def versions(self):
         if self.__versions is None:
             try:
-                async with aiohttp.ClientSession(raise_for_status=True) as client:
-                    async with client.get(
-                        f"https://{self.domain}/sources/{self.project}/cache.json"
-                    ) as resp:
-                        d = await resp.json()
-                        self.__versions = [Version(v) for v in d[2][self.project]]
+                self.__versions = [Version(v) for v in await self._cached_versions()]
             except Exception as exc:
                 logger.info("%s: error parsing repository: %s", self.recipe.name, exc)
                 logger.debug(traceback.format_exc())
                 self.__versions = list()
         return self.__versions
 
+    async def _cached_versions(self):
+        # the listing of the previous run is reused when the server answers
+        # that it did not change
+        url = f"https://{self.domain}/sources/{self.project}/cache.json"
+        cached = gnome_cache.get(url)
+        headers = {"If-None-Match": cached["etag"]} if cached else {}
+        async with client_session().get(url, headers=headers) as resp:
+            if resp.status == 304:
+                return cached["versions"]
+            d = await resp.json()
+            etag = resp.headers.get("ETag")
+        versions = list(d[2][self.project])
+        if etag:
+            gnome_cache.set(url, {"etag": etag, "versions": versions})
+        return versions
+
     def source_url(self, version):
         if version.unknown:
             return None
@@ -16,13 +16,14 @@ def format_duration(duration):
 
 def yn_question(question, default):
     default_txt = "[Y/n]" if default else "[y/N]"
+    prompt = f"{question} {default_txt} "
     while True:
-        txt = input(f"{question} {default_txt} ").strip().lower()
+        txt = input(prompt).strip().lower()
         if not txt:
             return default
-        elif txt[0] == "y":
+        if txt.startswith("y"):
             return True
-        elif txt[0] == "n":
+        if txt.startswith("n"):
             return False
 
 
@@ -23,21 +23,7 @@ class Version:
         if fixer is None:
             fixer = _fix_version
         self.original = version
-        self.fixed = fixer(version)
-        self.to_numeric = _to_numeric(self.fixed)
-        date_match = VERSION_DATE_RE.search(
-            self.fixed if self.fixed != self.UNKNOWN else self.original
-        )
-        date = None
-        if date_match:
-            try:
-                date = datetime(
-                    *[int(v) for v in date_match.groups()],
-                    tzinfo=timezone.utc,
-                )
-            except ValueError:
-                # happens if date is invalid
-                pass
+        self.fixed, self.to_numeric, date = _parse(version, fixer)
         self.is_date = bool(date)
         if not meta.date and self.is_date:
             meta = meta._replace(date=date)
@@ -88,6 +74,30 @@ class Version:
         return f"Version<{self.__str__()}>"
 
 
+@functools.lru_cache(maxsize=4096)
+def parse_version(version):
+    # shared instances: only for default fixer and meta, never mutate them
+    return Version(version)
+
+
+@functools.lru_cache(maxsize=8192)
+def _parse(version, fixer):
+    # the same tags are found in many repositories
+    fixed = fixer(version)
+    date_match = VERSION_DATE_RE.search(fixed if fixed != Version.UNKNOWN else version)
+    date = None
+    if date_match:
+        try:
+            date = datetime(
+                *[int(v) for v in date_match.groups()],
+                tzinfo=timezone.utc,
+            )
+        except ValueError:
+            # happens if date is invalid
+            pass
+    return fixed, _to_numeric(fixed), date
+
+
 def _fix_version(version):
     version = str(version)
 
@@ -1,9 +1,83 @@
+import io
+import os
+import asyncio
+import threading
+import concurrent.futures
+
 from ruamel.yaml import YAML
+from ruamel.yaml.comments import CommentedBase, CommentedMap, CommentedSeq
 from ruamel.yaml.constructor import DoubleQuotedScalarString
 
 yaml = YAML()
 yaml.preserve_quotes = True
 yaml.allow_duplicate_keys = True
 yaml.indent(mapping=2, sequence=4, offset=2)
+# keeps the round-trip work off the event loop, one call at a time since
+# the instance above is shared
+_round_trip_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+# Faster, libyaml-backed when available, but drops formatting: read-only use.
+# Recipes are loaded from several threads and YAML instances keep their parser
+# state, so each thread gets its own.
+_fast_instances = threading.local()
+
+
+def fast_load(stream):
+    if not hasattr(_fast_instances, "yaml"):
+        _fast_instances.yaml = YAML(typ="safe")
+        _fast_instances.yaml.allow_duplicate_keys = True
+    return _fast_instances.yaml.load(stream)
+
+
+def fast_load_file(path):
+    # one read of the whole file: the parser would otherwise pull the stream
+    # through its reader in small chunks
+    with open(path, "rb") as fil:
+        return fast_load(fil.read())
+
 
 DoubleQuotes = DoubleQuotedScalarString
+
+
+def copy_node(node):
+    # copy the containers with their comments and flow style, but not the
+    # scalars: they are immutable and keep their own style. Much faster than
+    # a deepcopy, which copies every scalar too
+    if isinstance(node, dict):
+        new_node = CommentedMap((k, copy_node(v)) for k, v in node.items())
+    elif isinstance(node, list):
+        new_node = CommentedSeq(copy_node(v) for v in node)
+    else:
+        return node
+    if isinstance(node, CommentedBase):
+        node.copy_attributes(new_node, memo={})
+    return new_node
+
+
+def dump_file(data, path):
+    # ruamel emits many small writes: render in memory, then write the file
+    # once and swap it in place so readers never see a partial document
+    buf = io.StringIO()
+    yaml.dump(data, buf)
+    content = buf.getvalue()
+
+    # leave an identical file untouched, e.g. when an update is retried
+    if os.path.exists(path):
+        with open(path) as fil:
+            if fil.read() == content:
+                return
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as fil:
+        fil.write(content)
+    os.replace(tmp_path, path)
+
+
+def load_file(path):
+    with open(path) as fil:
+        return yaml.load(fil)
+
+
+async def run_round_trip(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_round_trip_executor, func, *args)
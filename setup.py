@@ -28,6 +28,10 @@ setup(
         "colored<2",
         "conan<2",
     ],
+    extras_require={
+        "pygit2": ["pygit2"],
+        "orjson": ["orjson"],
+    },
     author="Quentin Chateau",
     author_email="quentin.chateau@gmail.com",
     description="A bot to automatically update conan-center-index",
@@ -0,0 +1,49 @@
+from ccb.yaml import yaml
+from ccb.update.common import smart_insert
+
+
+def load(text):
+    return yaml.load(text)
+
+
+def test_insert_ascending():
+    container = load('"1.0": a\n"2.0": b\n')
+    smart_insert(container, "1.5", "c")
+    assert list(container.keys()) == ["1.0", "1.5", "2.0"]
+
+
+def test_insert_descending():
+    container = load('"2.0": b\n"1.0": a\n')
+    smart_insert(container, "1.5", "c")
+    assert list(container.keys()) == ["2.0", "1.5", "1.0"]
+
+
+def test_readd_existing_key():
+    container = load('"1.0": a\n"1.5": old\n"2.0": b\n')
+    smart_insert(container, "1.5", "new")
+    assert list(container.items()) == [("1.0", "a"), ("1.5", "new"), ("2.0", "b")]
+
+
+def test_readd_existing_key_descending():
+    container = load('"2.0": b\n"1.5": old\n"1.0": a\n')
+    smart_insert(container, "1.5", "new")
+    assert list(container.items()) == [("2.0", "b"), ("1.5", "new"), ("1.0", "a")]
+
+
+def test_readd_single_entry():
+    container = load('"1.0": old\n')
+    smart_insert(container, "1.0", "new")
+    assert list(container.items()) == [("1.0", "new")]
+
+
+def test_insert_unsorted():
+    # before the first version that should come after the new one
+    container = load('"1.0": a\n"3.0": c\n"2.0": b\n"4.0": d\n')
+    smart_insert(container, "2.5", "e")
+    assert list(container.keys()) == ["1.0", "2.5", "3.0", "2.0", "4.0"]
+
+
+def test_insert_unsorted_descending():
+    container = load('"4.0": d\n"1.0": a\n"3.0": c\n"0.5": e\n')
+    smart_insert(container, "2.0", "b")
+    assert list(container.keys()) == ["4.0", "2.0", "1.0", "3.0", "0.5"]